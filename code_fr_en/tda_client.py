@@ -0,0 +1,117 @@
+"""
+Client for the resident TDA query service (14_tda_query_service.py).
+
+Start the service once in a terminal, then query it from any notebook:
+
+    from tda_client import TDAClient
+
+    with TDAClient() as tda:
+        dgms = tda.diagrams(0)
+        en_dist, en_tokens = tda.distance_matrix(0, 'en')
+        df = pd.DataFrame(tda.farthest(20))
+"""
+
+import os
+from pathlib import Path
+from multiprocessing.connection import Client
+
+DEFAULT_ADDRESS = ('localhost', 6017)
+
+# The service writes a random authkey to a user-only file at startup.
+# Set this to a shared key instead (required off localhost).
+AUTHKEY_ENV = 'TDA_SERVICE_AUTHKEY'
+AUTHKEY_DIR = Path.home() / '.tda_service'
+
+
+def authkey_path(port=DEFAULT_ADDRESS[1]):
+    """Path of the authkey file written by the service listening on port."""
+    return AUTHKEY_DIR / f'authkey_{port}'
+
+
+def get_authkey(port=DEFAULT_ADDRESS[1]):
+    """Authkey from $TDA_SERVICE_AUTHKEY, falling back to the service's key file."""
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if authkey:
+        return authkey.encode()
+
+    path = authkey_path(port)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"No authkey at {path}. Is 14_tda_query_service.py running on port {port}, "
+            f"or should ${AUTHKEY_ENV} be set?") from None
+
+
+class TDAClient:
+    """
+    Connection to a running TDA query service.
+
+    Args:
+        address: (host, port) of the service
+        authkey: Authentication key shared with the service (default: get_authkey(port))
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        if authkey is None:
+            authkey = get_authkey(address[1])
+        self.conn = Client(address, authkey=authkey)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _query(self, method, **kwargs):
+        self.conn.send((method, kwargs))
+        status, value = self.conn.recv()
+        if status != 'ok':
+            raise RuntimeError(f"TDA service error in {method}: {value}")
+        return value
+
+    def info(self):
+        """Sizes and configuration of the loaded store."""
+        return self._query('info')
+
+    def get(self, idx):
+        """Full TDA result for a pair (including diagrams)."""
+        return self._query('get', idx=idx)
+
+    def diagrams(self, idx):
+        """Persistence diagrams as {'en': [H0, H1], 'fr': [H0, H1]}."""
+        return self._query('diagrams', idx=idx)
+
+    def distance_matrix(self, idx, lang='en'):
+        """(distance_matrix, tokens) for one side of a pair."""
+        return self._query('distance_matrix', idx=idx, lang=lang)
+
+    def rank(self, idx, metric='wasserstein_distance'):
+        """Rank of a pair by metric (0 = smallest distance)."""
+        return self._query('rank', idx=idx, metric=metric)
+
+    def nearest(self, k=10, metric='wasserstein_distance'):
+        """Summaries of the k pairs with the smallest distance."""
+        return self._query('nearest', k=k, metric=metric)
+
+    def farthest(self, k=10, metric='wasserstein_distance'):
+        """Summaries of the k pairs with the largest distance."""
+        return self._query('farthest', k=k, metric=metric)
+
+    def by_tokens(self, num_tokens, lang='en'):
+        """idxs of pairs whose side `lang` has exactly num_tokens tokens."""
+        return self._query('by_tokens', num_tokens=num_tokens, lang=lang)
+
+    def filter(self, ranges=None, sort_by=None, descending=False, limit=None):
+        """
+        Summaries of pairs whose fields fall in the given inclusive ranges.
+
+        Example:
+            tda.filter({'en_num_tokens': (10, 20), 'wasserstein_distance': (0.5, None)},
+                       sort_by='wasserstein_distance', descending=True, limit=50)
+        """
+        return self._query('filter', ranges=ranges, sort_by=sort_by,
+                           descending=descending, limit=limit)
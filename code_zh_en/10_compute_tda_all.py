@@ -23,6 +23,9 @@ from persim import wasserstein
 # (This is expected for H0 diagrams - one component persists forever)
 warnings.filterwarnings('ignore', message='.*non-finite death times.*')
 
+# Special tokens dropped from distance matrices when filter_special=True
+SPECIAL_TOKENS = {'</s>', '<s>', '<pad>', 'eng_Latn', 'zho_Hans'}
+
 
 def build_distance_matrix(attention, tokens, filter_special=True):
     """
@@ -42,8 +45,7 @@ def build_distance_matrix(attention, tokens, filter_special=True):
 
     # 2. Filter special tokens (optional)
     if filter_special:
-        special_tokens = {'</s>', '<s>', '<pad>', 'eng_Latn', 'zho_Hans'}
-        content_mask = np.array([tok not in special_tokens for tok in tokens])
+        content_mask = np.array([tok not in SPECIAL_TOKENS for tok in tokens])
 
         if sum(content_mask) > 0:  # Only filter if there are content tokens
             # Filter attention matrix
@@ -74,6 +76,133 @@ def build_distance_matrix(attention, tokens, filter_special=True):
     return distance_matrix, filtered_tokens
 
 
+def pad_attention_batch(attentions, token_lists, filter_special=True):
+    """
+    Pad a list of attention tensors into one batch for build_distance_matrices.
+
+    Args:
+        attentions: List of attention tensors (num_heads, seq_len, seq_len) - LAST LAYER ONLY
+        token_lists: List of token string lists (one per attention tensor)
+        filter_special: Whether to mark special tokens for filtering
+
+    Returns:
+        padded: (batch, num_heads, max_len, max_len) array, zero padded
+        lengths: (batch,) array of sequence lengths
+        special_mask: (batch, max_len) bool array, True for special tokens
+                      (None if filter_special is False)
+    """
+    if len(attentions) == 0:
+        raise ValueError("Cannot pad an empty batch of attention tensors")
+    if len(attentions) != len(token_lists):
+        raise ValueError(f"Got {len(attentions)} attention tensors but {len(token_lists)} token lists")
+
+    lengths = np.array([len(tokens) for tokens in token_lists])
+    batch_size, max_len = len(attentions), int(lengths.max())
+    num_heads = attentions[0].shape[0]
+
+    padded = np.zeros((batch_size, num_heads, max_len, max_len), dtype=attentions[0].dtype)
+    special_mask = np.zeros((batch_size, max_len), dtype=bool) if filter_special else None
+    for b, (attention, tokens) in enumerate(zip(attentions, token_lists)):
+        n = lengths[b]
+        padded[b, :, :n, :n] = attention
+        if filter_special:
+            special_mask[b, :n] = np.isin(np.asarray(tokens, dtype=object), list(SPECIAL_TOKENS))
+
+    return padded, lengths, special_mask
+
+
+def build_distance_matrices(attention, lengths, special_mask=None, out=None, work=None):
+    """
+    Batched build_distance_matrix over a padded attention batch.
+
+    Content tokens of each sentence are moved to the front, so the distance
+    matrix of sentence b is out[b, :num_tokens[b], :num_tokens[b]] and matches
+    build_distance_matrix(attention[b, :, :n, :n], tokens[b], filter_special)
+    with n = lengths[b] and filter_special = special_mask is not None.
+    The one exception is a kept row whose attention sums to zero after filtering:
+    build_distance_matrix divides by zero and gives NaN, while here the row stays
+    zero, giving distance 1 to every other token (and 0 on the diagonal).
+    Entries outside that block are 0.
+
+    Args:
+        attention: Padded attention (batch, num_heads, max_len, max_len) - LAST LAYER ONLY
+        lengths: (batch,) array of sequence lengths
+        special_mask: Optional (batch, max_len) bool array, True for tokens to filter.
+                      Sentences with no content tokens keep all their tokens (unfiltered).
+                      None disables filtering (and renormalization).
+        out: Optional preallocated C-contiguous (batch, max_len, max_len) output buffer
+        work: Optional preallocated C-contiguous (batch, max_len, max_len) scratch buffer
+              with the same dtype as out (must not share memory with out)
+
+    Returns:
+        out: (batch, max_len, max_len) distance matrices
+        num_tokens: (batch,) number of tokens kept per sentence
+    """
+    batch_size, num_heads, max_len, _ = attention.shape
+    shape = (batch_size, max_len, max_len)
+    dtype = np.result_type(attention.dtype, np.float32) if out is None else out.dtype
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    if work is None:
+        work = np.empty(shape, dtype=dtype)
+    for name, buffer in (('out', out), ('work', work)):
+        if buffer.shape != shape or buffer.dtype != dtype or not buffer.flags.c_contiguous:
+            raise ValueError(f"{name} must be a C-contiguous {dtype} array of shape {shape}")
+    if np.shares_memory(out, work):
+        raise ValueError("out and work must be separate buffers")
+
+    # 1. Average over heads (np.mean would allocate a temporary here)
+    np.sum(attention, axis=1, out=work)
+    work /= num_heads
+
+    # 2. Select tokens to keep (fall back to all tokens if no content tokens)
+    positions = np.arange(max_len)
+    valid = positions < np.asarray(lengths)[:, None]  # (batch, max_len)
+    if special_mask is not None:
+        keep = valid & ~special_mask
+        renormalize = keep.any(axis=1)
+        keep[~renormalize] = valid[~renormalize]
+    else:
+        keep = valid
+        renormalize = np.zeros(batch_size, dtype=bool)
+    num_tokens = keep.sum(axis=1)
+
+    # Move kept tokens to the front (stable, so token order is preserved).
+    # Rows are gathered twice with a transpose in between, giving the
+    # transposed filtered matrix in out without any (batch, L, L) temporaries
+    # (mode='clip' stops np.take from buffering out; indices are always in range).
+    order = np.argsort(~keep, axis=1, kind='stable')
+    row_idx = (np.arange(batch_size)[:, None] * max_len + order).ravel()
+    out_rows = out.reshape(-1, max_len)
+    np.take(work.reshape(-1, max_len), row_idx, axis=0, out=out_rows, mode='clip')
+    np.copyto(work, out.transpose(0, 2, 1))
+    np.take(work.reshape(-1, max_len), row_idx, axis=0, out=out_rows, mode='clip')
+
+    kept = positions < num_tokens[:, None]  # (batch, max_len)
+    out *= kept[:, :, None]
+    out *= kept[:, None, :]
+
+    # 3. Renormalize filtered rows, i.e. columns of the transposed matrix
+    #    (rows summing to zero stay zero)
+    row_sums = out.sum(axis=1, keepdims=True)  # (batch, 1, max_len)
+    np.divide(out, row_sums, out=out,
+              where=(row_sums > 0) & renormalize[:, None, None])
+
+    # 4. Symmetrize (make undirected)
+    np.add(out, out.transpose(0, 2, 1), out=work)
+
+    # 5. Convert to distance: d = 1 - attention
+    np.multiply(work, -0.5, out=out)
+    out += 1
+
+    # Ensure diagonal and padding are 0
+    out[:, positions, positions] = 0
+    out *= kept[:, :, None]
+    out *= kept[:, None, :]
+
+    return out, num_tokens
+
+
 def compute_persistence_and_wasserstein(en_attention, en_tokens, zh_attention, zh_tokens,
                                         filter_special=True):
     """
@@ -0,0 +1,360 @@
+"""
+Resident query service for interactive exploration of TDA results.
+
+Loads the attention store and TDA results once, keeps them in memory and answers
+queries from notebooks over a local socket (see tda_client.py):
+1. Indexes results by idx, token count and Wasserstein rank
+2. Serves persistence diagrams and (cached) distance matrices for a sentence pair
+3. Serves nearest / farthest pairs and filtered subsets
+
+Usage:
+    python 14_tda_query_service.py            # serve filtered results
+    python 14_tda_query_service.py --no-filter-special
+"""
+
+import numpy as np
+from pathlib import Path
+import pickle
+import importlib.util
+import threading
+import time
+import argparse
+import os
+import ipaddress
+import secrets
+import socket
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+
+from tda_client import DEFAULT_ADDRESS, AUTHKEY_ENV, AUTHKEY_DIR, authkey_path
+
+# Seconds a new client has to complete the authkey handshake
+HANDSHAKE_TIMEOUT = 5
+
+METRICS = ('wasserstein_distance', 'wasserstein_h0', 'wasserstein_h1')
+SCALAR_FIELDS = (
+    'idx', 'en_text', 'zh_text', 'en_translation', 'zh_translation',
+    'wasserstein_distance', 'wasserstein_h0', 'wasserstein_h1',
+    'en_num_tokens', 'zh_num_tokens',
+    'en_h0_features', 'en_h1_features', 'zh_h0_features', 'zh_h1_features'
+)
+
+# Reuse build_distance_matrix from step 10 (module name starts with a digit)
+_spec = importlib.util.spec_from_file_location(
+    'compute_tda_all', Path(__file__).with_name('10_compute_tda_all.py'))
+compute_tda_all = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(compute_tda_all)
+
+
+class TDAStore:
+    """
+    In-memory attention store and TDA results with lookup indexes.
+
+    Args:
+        attention_data: List of examples from all_encoder_attention_last_layer.pkl
+        tda_results: List of results from 10_compute_tda_all.py
+        filter_special: Whether distance matrices filter special tokens
+                        (should match the setting used for tda_results)
+    """
+
+    # Methods that clients are allowed to call
+    QUERIES = ('info', 'get', 'diagrams', 'distance_matrix', 'rank',
+               'nearest', 'farthest', 'by_tokens', 'filter')
+
+    def __init__(self, attention_data, tda_results, filter_special=True):
+        self.attention_data = attention_data
+        self.filter_special = filter_special
+
+        # Index by idx
+        self.by_idx = {r['idx']: r for r in tda_results}
+        self.idxs = np.array(sorted(self.by_idx), dtype=int)
+
+        # Column arrays aligned with self.idxs (for vectorised filtering)
+        self.columns = {
+            field: np.array([self.by_idx[i][field] for i in self.idxs])
+            for field in METRICS + ('en_num_tokens', 'zh_num_tokens')
+        }
+
+        # Index by token count: lang -> {num_tokens: [idx, ...]}
+        self.token_index = {}
+        for lang in ('en', 'zh'):
+            index = {}
+            for i, n in zip(self.idxs, self.columns[f'{lang}_num_tokens']):
+                index.setdefault(int(n), []).append(int(i))
+            self.token_index[lang] = index
+
+        # Index by rank: metric -> idxs sorted ascending, and idx -> rank
+        self.order = {}
+        self.ranks = {}
+        for metric in METRICS:
+            order = self.idxs[np.argsort(self.columns[metric], kind='stable')]
+            self.order[metric] = order
+            self.ranks[metric] = {int(i): r for r, i in enumerate(order)}
+
+        # Distance matrices are built lazily: (idx, lang) -> (matrix, tokens)
+        self._dist_cache = {}
+        self._dist_lock = threading.Lock()
+
+    def _record(self, idx):
+        if idx not in self.by_idx:
+            raise KeyError(f"No TDA result for idx {idx}")
+        return self.by_idx[idx]
+
+    def _summary(self, idx):
+        record = self.by_idx[idx]
+        return {field: record[field] for field in SCALAR_FIELDS}
+
+    def _check_metric(self, metric):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {METRICS}")
+
+    def _check_k(self, k):
+        if not isinstance(k, (int, np.integer)) or isinstance(k, bool) or k < 0:
+            raise ValueError(f"k must be a non-negative int, got {k!r}")
+
+    def info(self):
+        """Sizes and configuration of the loaded store."""
+        return {
+            'num_pairs': len(self.idxs),
+            'num_attention': len(self.attention_data),
+            'filter_special': self.filter_special,
+            'cached_distance_matrices': len(self._dist_cache),
+        }
+
+    def get(self, idx):
+        """Full TDA result for a pair (including diagrams)."""
+        return self._record(idx)
+
+    def diagrams(self, idx):
+        """Persistence diagrams [H0, H1] for both languages of a pair."""
+        record = self._record(idx)
+        return {'en': record['en_diagrams'], 'zh': record['zh_diagrams']}
+
+    def distance_matrix(self, idx, lang='en'):
+        """Distance matrix and (filtered) tokens for one side of a pair."""
+        if lang not in ('en', 'zh'):
+            raise ValueError(f"Unknown language {lang!r}, expected 'en' or 'zh'")
+        self._record(idx)
+
+        key = (idx, lang)
+        cached = self._dist_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Build outside the lock so a cold build does not block other clients
+        example = self.attention_data[idx]
+        result = compute_tda_all.build_distance_matrix(
+            example[f'{lang}_attention'], example[f'{lang}_tokens'],
+            self.filter_special)
+        with self._dist_lock:
+            return self._dist_cache.setdefault(key, result)
+
+    def rank(self, idx, metric='wasserstein_distance'):
+        """Rank of a pair by metric (0 = smallest distance)."""
+        self._check_metric(metric)
+        self._record(idx)
+        return self.ranks[metric][idx]
+
+    def nearest(self, k=10, metric='wasserstein_distance'):
+        """Summaries of the k pairs with the smallest distance."""
+        self._check_metric(metric)
+        self._check_k(k)
+        return [self._summary(int(i)) for i in self.order[metric][:k]]
+
+    def farthest(self, k=10, metric='wasserstein_distance'):
+        """Summaries of the k pairs with the largest distance."""
+        self._check_metric(metric)
+        self._check_k(k)
+        return [self._summary(int(i)) for i in self.order[metric][::-1][:k]]
+
+    def by_tokens(self, num_tokens, lang='en'):
+        """idxs of pairs whose side `lang` has exactly num_tokens tokens."""
+        if lang not in self.token_index:
+            raise ValueError(f"Unknown language {lang!r}, expected 'en' or 'zh'")
+        return list(self.token_index[lang].get(num_tokens, []))
+
+    def filter(self, ranges=None, sort_by=None, descending=False, limit=None):
+        """
+        Summaries of pairs whose fields fall in the given inclusive ranges.
+
+        Args:
+            ranges: Dict mapping a numeric field (e.g. 'en_num_tokens',
+                    'wasserstein_distance') to (low, high); None means unbounded
+            sort_by: Optional numeric field to sort by
+            descending: Sort order when sort_by is given
+            limit: Maximum number of summaries to return
+        """
+        keep = np.ones(len(self.idxs), dtype=bool)
+        for field, (low, high) in (ranges or {}).items():
+            if field not in self.columns:
+                raise ValueError(f"Cannot filter on {field!r}, expected one of {tuple(self.columns)}")
+            if low is not None:
+                keep &= self.columns[field] >= low
+            if high is not None:
+                keep &= self.columns[field] <= high
+
+        selected = np.flatnonzero(keep)
+        if sort_by is not None:
+            if sort_by not in self.columns:
+                raise ValueError(f"Cannot sort by {sort_by!r}, expected one of {tuple(self.columns)}")
+            selected = selected[np.argsort(self.columns[sort_by][selected], kind='stable')]
+            if descending:
+                selected = selected[::-1]
+        if limit is not None:
+            selected = selected[:limit]
+
+        return [self._summary(int(i)) for i in self.idxs[selected]]
+
+
+def handle_connection(conn, store):
+    """Answer (method, kwargs) requests on one client connection until it closes."""
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                # The whole message was read, so the stream is still in sync
+                reply = ('error', f"Could not unpickle query: {type(e).__name__}: {e}")
+            else:
+                try:
+                    method, kwargs = message
+                    if method not in TDAStore.QUERIES:
+                        raise ValueError(f"Unknown query {method!r}")
+                    if not isinstance(kwargs, dict):
+                        raise TypeError(f"Query arguments must be a dict, got {type(kwargs).__name__}")
+                    reply = ('ok', getattr(store, method)(**kwargs))
+                except Exception as e:
+                    reply = ('error', f"{type(e).__name__}: {e}")
+
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                # Client disconnected before reading the reply
+                return
+
+
+def _shutdown_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def serve_client(sock, store, authkey):
+    """Authenticate a newly accepted socket, then answer its queries."""
+    # Connection gets its own fd; shutting down sock unblocks a stalled handshake
+    conn = Connection(os.dup(sock.fileno()))
+    timer = threading.Timer(HANDSHAKE_TIMEOUT, _shutdown_socket, args=(sock,))
+    timer.start()
+    try:
+        deliver_challenge(conn, authkey)
+        answer_challenge(conn, authkey)
+    except (AuthenticationError, EOFError, OSError) as e:
+        print(f"⚠️  Rejected connection: {type(e).__name__}: {e}")
+        conn.close()
+        return
+    finally:
+        timer.cancel()
+        sock.close()
+
+    handle_connection(conn, store)
+
+
+def write_authkey(port):
+    """Generate a random authkey and write it to a user-only (0600) file."""
+    AUTHKEY_DIR.mkdir(mode=0o700, exist_ok=True)
+    os.chmod(AUTHKEY_DIR, 0o700)
+
+    path = authkey_path(port)
+    path.unlink(missing_ok=True)
+    authkey = secrets.token_hex(32).encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey, path
+
+
+def is_loopback(host):
+    """Whether host resolves to a loopback address."""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Serve TDA results for interactive exploration')
+    parser.add_argument('--filter-special', action='store_true', default=True,
+                        help='Serve filtered results (default: True)')
+    parser.add_argument('--no-filter-special', dest='filter_special', action='store_false',
+                        help='Serve unfiltered results')
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0],
+                        help=f'Host to listen on (default: {DEFAULT_ADDRESS[0]}); '
+                             f'non-loopback hosts require {AUTHKEY_ENV} to be set')
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1],
+                        help=f'Port to listen on (default: {DEFAULT_ADDRESS[1]})')
+    args = parser.parse_args()
+
+    # Remote clients cannot read the local key file, so they need a shared key
+    if not is_loopback(args.host) and not os.environ.get(AUTHKEY_ENV):
+        parser.error(f"Refusing to listen on non-loopback host {args.host!r} "
+                     f"without a private authkey in ${AUTHKEY_ENV}")
+
+    print("=" * 80)
+    print("TDA Query Service")
+    print("=" * 80)
+
+    # Configuration
+    ATTENTION_PATH = Path("../data/attention_maps_zh_en/all_encoder_attention_last_layer.pkl")
+    filter_str = "filtered" if args.filter_special else "unfiltered"
+    TDA_PATH = Path(f"../data/tda_results_zh_en/tda_results_last_layer_{filter_str}.pkl")
+
+    start_time = time.time()
+
+    print(f"Loading attention data from {ATTENTION_PATH}...")
+    print(f"File size: {ATTENTION_PATH.stat().st_size / (1024**2):.2f} MB")
+    with open(ATTENTION_PATH, 'rb') as f:
+        attention_data = pickle.load(f)
+    print(f"✓ Loaded {len(attention_data)} sentence pairs")
+
+    print(f"Loading TDA results from {TDA_PATH}...")
+    with open(TDA_PATH, 'rb') as f:
+        tda_results = pickle.load(f)
+    print(f"✓ Loaded {len(tda_results)} TDA results")
+
+    store = TDAStore(attention_data, tda_results, filter_special=args.filter_special)
+    print(f"✓ Built indexes in {time.time() - start_time:.1f} sec total")
+    print()
+
+    # Messages are unpickled, so only clients holding the authkey may connect
+    if os.environ.get(AUTHKEY_ENV):
+        authkey, key_path = os.environ[AUTHKEY_ENV].encode(), None
+        print(f"Using authkey from ${AUTHKEY_ENV}")
+    else:
+        authkey, key_path = write_authkey(args.port)
+        print(f"✓ Wrote authkey to {key_path}")
+
+    address = (args.host, args.port)
+    with socket.create_server(address) as server:
+        print(f"Listening on {address[0]}:{address[1]} (Ctrl+C to stop)")
+        try:
+            while True:
+                # Handshakes run in the client thread so a stalled client cannot block accept()
+                try:
+                    sock, _ = server.accept()
+                except OSError as e:
+                    print(f"⚠️  Accept failed: {type(e).__name__}: {e}")
+                    continue
+                threading.Thread(target=serve_client, args=(sock, store, authkey), daemon=True).start()
+        except KeyboardInterrupt:
+            print("\nShutting down")
+        finally:
+            if key_path is not None:
+                key_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    main()